@@ -1,6 +1,4 @@
-import sounddevice as sd
 import numpy as np
-from opuslib import Encoder, Decoder, OpusError
 # When running as a script, handle imports differently
 if __name__ == '__main__':
     from constants import SAMPLE_RATE, CHANNELS, CHUNK_SIZE
@@ -8,15 +6,34 @@ else:
     from .constants import SAMPLE_RATE, CHANNELS, CHUNK_SIZE
 
 # Opus Encoder and Decoder
-# These are created once and reused.
-try:
-    opus_encoder = Encoder(SAMPLE_RATE, CHANNELS, 'voip') # 'voip', 'audio', or 'restricted_lowdelay'
-    opus_decoder = Decoder(SAMPLE_RATE, CHANNELS)
-except OpusError as e:
-    print(f"Failed to initialize Opus encoder/decoder: {e}")
-    # Fallback or error handling if Opus is not available or fails to initialize
-    opus_encoder = None
-    opus_decoder = None
+# These are created once by init_codec() during session setup and reused.
+# Importing opuslib loads the native library, so it is deferred to keep imports of this module cheap.
+# Until init_codec() succeeds, encode_audio/decode_audio use the raw int16 fallback.
+opus_encoder = None
+opus_decoder = None
+OpusError = Exception # Replaced with opuslib's OpusError by init_codec()
+
+def init_codec():
+    """
+    Creates the shared Opus encoder/decoder if they don't exist yet.
+    Safe to call more than once. Returns True if Opus is available,
+    False if the raw int16 fallback will be used instead.
+    """
+    global opus_encoder, opus_decoder, OpusError
+    if opus_encoder and opus_decoder:
+        return True
+    try:
+        # opuslib raises a plain Exception at import time if the native library is missing
+        from opuslib import Encoder, Decoder, OpusError
+        opus_encoder = Encoder(SAMPLE_RATE, CHANNELS, 'voip') # 'voip', 'audio', or 'restricted_lowdelay'
+        opus_decoder = Decoder(SAMPLE_RATE, CHANNELS)
+        return True
+    except Exception as e:
+        print(f"Failed to initialize Opus encoder/decoder: {e}")
+        # Fallback or error handling if Opus is not available or fails to initialize
+        opus_encoder = None
+        opus_decoder = None
+        return False
 
 def encode_audio(audio_data_np):
     """
@@ -95,6 +112,132 @@ def decode_audio(encoded_data):
         print(f"Unexpected error during decoding: {e}")
         return np.array([], dtype=np.float32)
 
+KAISER_BETA = 8.0 # Resampling filter window; ~80 dB stopband attenuation
+
+class AudioConverter:
+    """
+    Converts streaming audio between a device's native format and the codec format
+    (e.g. 44.1 kHz stereo microphone -> 48 kHz mono), so devices can be opened at
+    the rate and channel count they actually run at instead of relying on PortAudio/OS resampling.
+
+    Resampling uses a vectorized polyphase FIR filter (windowed sinc). The filter history
+    is kept between calls, so blocks of any size can be fed in without clicks at block boundaries.
+    Channels are mixed down before resampling and up after it, to filter as few channels as possible.
+    """
+
+    def __init__(self, from_rate, from_channels, to_rate, to_channels, chunk_size=None, taps_per_phase=32):
+        """
+        chunk_size: if given, convert_chunks() re-slices the output into chunks of exactly
+                    this many frames (what the Opus encoder needs).
+        taps_per_phase: filter length, in taps per polyphase branch at the higher of the two
+                        resampling factors; longer is sharper but costs more CPU.
+        """
+        self.from_rate = int(from_rate)
+        self.to_rate = int(to_rate)
+        self.from_channels = from_channels
+        self.to_channels = to_channels
+        self.chunk_size = chunk_size
+
+        # Rational resampling factor up/down, e.g. 44100 -> 48000 is 160/147
+        g = np.gcd(self.from_rate, self.to_rate)
+        self.up = self.to_rate // g
+        self.down = self.from_rate // g
+        self.needs_resampling = self.up != self.down
+
+        if self.needs_resampling:
+            # The transition band narrows with the filter length relative to the lower Nyquist, so size
+            # the prototype by max(up, down); when decimating, each branch gets proportionally more taps.
+            # Rounded up to a whole number of taps per branch.
+            taps_per_phase = -(-max(self.up, self.down) * taps_per_phase // self.up)
+            self.taps_per_phase = taps_per_phase
+            num_taps = self.up * taps_per_phase
+            # Low-pass below the lower of the two Nyquist frequencies (normalized to the upsampled rate).
+            # The cutoff is placed half a transition band below Nyquist, so the stopband starts at
+            # Nyquist and nothing above it folds back. Transition width from Kaiser's design formula.
+            nyquist = 0.5 / max(self.up, self.down)
+            attenuation_db = KAISER_BETA / 0.1102 + 8.7
+            transition = (attenuation_db - 8) / (2.285 * 2 * np.pi * (num_taps - 1))
+            cutoff = nyquist - transition / 2
+            t = np.arange(num_taps) - (num_taps - 1) / 2.0
+            taps = 2 * cutoff * np.sinc(2 * cutoff * t) * np.kaiser(num_taps, KAISER_BETA)
+            taps *= self.up / taps.sum() # Unity DC gain: each polyphase branch sums to ~1
+            # polyphase_taps[phase, j] == taps[phase + j * up]
+            self.polyphase_taps = taps.reshape(taps_per_phase, self.up).T.astype(np.float32)
+            self.history = np.zeros((taps_per_phase - 1, self._filter_channels()), dtype=np.float32)
+            self.tap_offsets = np.arange(taps_per_phase)
+            self.in_count = 0 # Input frames consumed (relative to the last rebase)
+            self.out_count = 0 # Output frames produced (relative to the last rebase)
+
+        self.pending = np.zeros((0, to_channels), dtype=np.float32) # Leftover frames for convert_chunks()
+
+    def _filter_channels(self):
+        return min(self.from_channels, self.to_channels)
+
+    def _mix(self, block, channels):
+        """Mixes (frames, n) audio to (frames, channels). Stereo<->mono folds/duplicates."""
+        if block.shape[1] == channels:
+            return block
+        if channels == 1:
+            return block.mean(axis=1, keepdims=True, dtype=np.float32)
+        if block.shape[1] != 1:
+            block = block.mean(axis=1, keepdims=True, dtype=np.float32)
+        return np.repeat(block, channels, axis=1)
+
+    def _resample(self, block):
+        """Runs one block through the polyphase filter, continuing from the previous block."""
+        num_frames = block.shape[0]
+        if num_frames == 0:
+            return np.zeros((0, block.shape[1]), dtype=np.float32)
+
+        # Output frame n reads input frame (n * down) // up with filter phase (n * down) % up.
+        # Produce every output frame whose input position falls inside the data seen so far.
+        in_total = self.in_count + num_frames
+        out_end = (in_total * self.up + self.down - 1) // self.down
+        positions = np.arange(self.out_count, out_end, dtype=np.int64) * self.down
+        input_frames = positions // self.up
+        phases = positions % self.up
+
+        # buffer[0] holds the input frame at index in_count - len(history)
+        buffer = np.concatenate((self.history, block.astype(np.float32, copy=False)))
+        indices = (input_frames - self.in_count + len(self.history))[:, None] - self.tap_offsets[None, :]
+        out = np.einsum('nt,ntc->nc', self.polyphase_taps[phases], buffer[indices])
+
+        self.history = buffer[len(buffer) - len(self.history):]
+        self.in_count = in_total
+        self.out_count = out_end
+        # Rebase the counters by whole filter periods so they never grow without bound
+        periods = min(self.out_count // self.up, self.in_count // self.down)
+        self.out_count -= periods * self.up
+        self.in_count -= periods * self.down
+        return out
+
+    def convert(self, block):
+        """
+        Converts a block of audio. block: NumPy array of shape (frames,) or (frames, from_channels).
+        Returns a float32 array of shape (frames', to_channels); frames' varies by ±1 between
+        blocks when resampling.
+        """
+        block = np.asarray(block, dtype=np.float32).reshape(-1, self.from_channels)
+        if self.to_channels < self.from_channels:
+            block = self._mix(block, self.to_channels)
+        if self.needs_resampling:
+            block = self._resample(block)
+        return self._mix(block, self.to_channels)
+
+    def convert_chunks(self, block):
+        """
+        Converts a block of audio and returns a list of complete chunk_size-frame chunks.
+        Frames that don't fill a chunk are kept for the next call.
+        """
+        converted = self.convert(block)
+        if not len(self.pending) and len(converted) == self.chunk_size:
+            return [converted] # Common case: device already runs in the codec format
+        if len(self.pending):
+            converted = np.concatenate((self.pending, converted))
+        num_chunks = len(converted) // self.chunk_size
+        self.pending = converted[num_chunks * self.chunk_size:]
+        return [converted[i * self.chunk_size:(i + 1) * self.chunk_size] for i in range(num_chunks)]
+
 # Note: Actual capture_audio and play_audio functions using sounddevice
 # will be part of the client logic, as they involve streams that need to be
 # actively managed (started/stopped). This file provides the encoding/decoding utilities.
@@ -102,6 +245,7 @@ def decode_audio(encoded_data):
 if __name__ == '__main__':
     # Simple test for encoding and decoding
     print("Running audio_utils self-test...")
+    init_codec()
     if not opus_encoder or not opus_decoder:
         print("Opus not available. Skipping self-test.")
     else:
@@ -1,10 +1,13 @@
 import asyncio
 import socket
-import sounddevice as sd
 import numpy as np
-import keyboard # For PTT
 import argparse
 import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from time import perf_counter_ns, time_ns
+# sounddevice and keyboard are imported lazily in main_client()/open_audio_streams()
+# so that importing this module (and --help) doesn't pay for PortAudio or input hooks.
 
 from .constants import (
     DEFAULT_SERVER_PORT,
@@ -12,15 +15,30 @@ from .constants import (
     SAMPLE_RATE,
     CHANNELS,
     CHUNK_SIZE,
-    PTT_KEY
+    PTT_KEY,
+    PREROLL_MS,
+    AUDIO_SETUP_TIMEOUT
 )
-from .audio_utils import encode_audio, decode_audio
+from .audio_utils import encode_audio, decode_audio, init_codec, AudioConverter
+from . import profiling
 
 # Global state
 is_ptt_active = False
 shutdown_event = asyncio.Event() # Used to signal all tasks to shut down
 loop = None # Will hold the asyncio event loop for the main client thread
 
+# Ring buffer of the most recent microphone chunks captured while PTT is released.
+# Flushed ahead of live audio when PTT engages so the first syllables aren't lost.
+PREROLL_CHUNKS = max(1, round(PREROLL_MS * SAMPLE_RATE / (1000 * CHUNK_SIZE)))
+preroll_buffer = deque(maxlen=PREROLL_CHUNKS)
+
+# Converters between the devices' native formats and the codec format (SAMPLE_RATE/CHANNELS).
+# Created in open_audio_streams(); None means audio is already in the codec format.
+input_converter = None
+output_converter = None
+# Fixed device buffer latencies reported by PortAudio, included in the --profile report
+device_latency_ms = {}
+
 # Audio callback for sounddevice stream (input)
 def audio_input_callback(indata, frames, time, status):
     """
@@ -30,16 +48,57 @@ def audio_input_callback(indata, frames, time, status):
     if status:
         print(f"Audio input status: {status}", flush=True)
 
-    if is_ptt_active and hasattr(audio_input_callback, 'udp_socket') and hasattr(audio_input_callback, 'server_audio_addr'):
-        # print(f"PTT active, sending {frames} frames", flush=True)
-        encoded_data = encode_audio(indata) # indata is a NumPy array
-        if encoded_data:
-            try:
-                audio_input_callback.udp_socket.sendto(encoded_data, audio_input_callback.server_audio_addr)
-            except Exception as e:
-                print(f"Error sending audio data: {e}", flush=True)
-    # else:
-        # print(f"PTT not active or UDP not ready. Frames: {frames}", flush=True)
+    capture_time_ns = None
+    if profiling.enabled:
+        if time is not None and time.inputBufferAdcTime > 0:
+            # Age of the block's first sample when the callback runs; also dates the packets for the receivers
+            capture_latency_ns = int((time.currentTime - time.inputBufferAdcTime) * 1e9)
+            profiling.record('capture', capture_latency_ns)
+            capture_time_ns = time_ns() - capture_latency_ns
+        else:
+            # Some host APIs don't report ADC times; date the packets from callback entry instead,
+            # so receivers still measure the network stage (without the capture buffering)
+            profiling.adc_time_unavailable = True
+            capture_time_ns = time_ns()
+
+    # Convert from the device's native format into CHUNK_SIZE-frame chunks in the codec format
+    chunks = input_converter.convert_chunks(indata) if input_converter else [indata]
+
+    for chunk in chunks:
+        if is_ptt_active and hasattr(audio_input_callback, 'udp_socket') and hasattr(audio_input_callback, 'server_audio_addr'):
+            # print(f"PTT active, sending {frames} frames", flush=True)
+            # Send the pre-roll first (only non-empty on the first chunk after PTT engaged).
+            # It isn't timestamped: it was captured before this block and would skew the network stage.
+            while preroll_buffer:
+                send_audio_chunk(preroll_buffer.popleft())
+            send_audio_chunk(chunk, capture_time_ns) # chunk is a NumPy array
+        else:
+            # print(f"PTT not active or UDP not ready. Frames: {frames}", flush=True)
+            # sounddevice reuses indata's buffer, so keep a copy
+            preroll_buffer.append(chunk.copy())
+
+def send_audio_chunk(audio_data_np, capture_time_ns=None):
+    """
+    Encodes one chunk of microphone audio and sends it to the server's audio port.
+    capture_time_ns: when profiling, the chunk's capture time (time.time_ns() clock) to stamp the packet with.
+    """
+    profile = profiling.enabled
+    if profile:
+        start_ns = perf_counter_ns()
+    encoded_data = encode_audio(audio_data_np)
+    if profile:
+        profiling.record_since('encode', start_ns)
+    if encoded_data:
+        if profile and capture_time_ns is not None:
+            encoded_data = profiling.stamp_packet(encoded_data, capture_time_ns)
+        try:
+            if profile:
+                start_ns = perf_counter_ns()
+            audio_input_callback.udp_socket.sendto(encoded_data, audio_input_callback.server_audio_addr)
+            if profile:
+                profiling.record_since('send', start_ns)
+        except Exception as e:
+            print(f"Error sending audio data: {e}", flush=True)
 
 
 # Audio output callback for sounddevice stream (output) - not directly used for playback from network
@@ -71,9 +130,28 @@ async def listen_for_audio(udp_socket, output_stream):
                 data, addr = udp_socket.recvfrom(CHUNK_SIZE * 4) # Buffer size, assuming max compression still fits
                 # print(f"Received audio from {addr}, {len(data)} bytes", flush=True)
                 if data:
+                    # Packets from a profiling sender carry their capture time; strip it either way
+                    data, capture_time_ns = profiling.unstamp_packet(data)
+                    profile = profiling.enabled
+                    if profile:
+                        if capture_time_ns is not None:
+                            profiling.record('network', time_ns() - capture_time_ns)
+                        start_ns = perf_counter_ns()
                     decoded_audio = decode_audio(data)
+                    if profile:
+                        profiling.record_since('decode', start_ns)
                     if decoded_audio.size > 0:
+                        if output_converter:
+                            if profile:
+                                start_ns = perf_counter_ns()
+                            decoded_audio = output_converter.convert(decoded_audio)
+                            if profile:
+                                profiling.record_since('convert', start_ns)
+                        if profile:
+                            start_ns = perf_counter_ns()
                         output_stream.write(decoded_audio) # Play decoded audio
+                        if profile:
+                            profiling.record_since('playout_write', start_ns)
                     # else:
                         # print("Decoded audio is empty, possibly a decode error or silent packet.", flush=True)
             except socket.timeout:
@@ -87,99 +165,212 @@ async def listen_for_audio(udp_socket, output_stream):
         print("Audio listening stopped.", flush=True)
 
 
-async def main_client(server_ip, server_port_tcp):
-    global loop
-    loop = asyncio.get_running_loop() # Get the loop for this async context
-
-    # --- Setup PTT ---
-    # keyboard.on_press_key(PTT_KEY, lambda _: ptt_on(), suppress=False)
-    # keyboard.on_release_key(PTT_KEY, lambda _: ptt_off(), suppress=False)
-    # Using keyboard.add_hotkey for better PTT semantics (triggers once on press/release)
-    try:
-        keyboard.add_hotkey(PTT_KEY, ptt_on, suppress=False, trigger_on_release=False)
-        keyboard.add_hotkey(PTT_KEY, ptt_off, suppress=False, trigger_on_release=True)
-        print(f"PTT enabled. Press and hold '{PTT_KEY}' to talk.", flush=True)
-    except Exception as e:
-        print(f"Could not set up PTT hotkey '{PTT_KEY}'. Is 'sudo' required or is the key name correct? Error: {e}", flush=True)
-        print("PTT will NOT work. You may need to run as root or configure input permissions.", flush=True)
-
-
-    # --- Setup UDP socket for audio ---
-    # Create UDP socket for sending and receiving audio
-    # Client needs to pick a free UDP port.
-    client_udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    client_udp_socket.bind(('', 0)) # Bind to any available local port
-    client_udp_port = client_udp_socket.getsockname()[1]
-    print(f"Client UDP audio endpoint: {client_udp_socket.getsockname()}", flush=True)
-
-    server_audio_port_udp = server_port_tcp + AUDIO_PORT_OFFSET
-    server_audio_addr = (server_ip, server_audio_port_udp)
-
-    # Make server_audio_addr available to the audio_input_callback
-    audio_input_callback.udp_socket = client_udp_socket
-    audio_input_callback.server_audio_addr = server_audio_addr
-
+def query_device_format(sd, kind):
+    """
+    Returns (samplerate, channels) the default 'input' or 'output' device natively runs at.
+    Uses CHANNELS if the device accepts it at its native rate, otherwise the smallest channel count
+    it does accept (e.g. 2 on stereo-only hardware). Opening every channel of a multi-channel
+    interface would have AudioConverter average one live mic with the silent inputs.
+    """
+    info = sd.query_devices(kind=kind)
+    samplerate = int(info['default_samplerate'])
+    max_channels = info[f'max_{kind}_channels']
+    check_settings = sd.check_input_settings if kind == 'input' else sd.check_output_settings
+    candidates = [CHANNELS] + [n for n in range(1, max_channels + 1) if n != CHANNELS]
+    for channels in candidates:
+        try:
+            check_settings(samplerate=samplerate, channels=channels, dtype='float32')
+            return samplerate, channels
+        except Exception:
+            continue
+    # Nothing passed the check; let opening the stream report the actual error
+    return samplerate, max_channels
+
+def make_converter(device_format, to_codec):
+    """
+    Creates the AudioConverter between a device format and the codec format,
+    or returns None if the device already runs in the codec format.
+    """
+    samplerate, channels = device_format
+    if (samplerate, channels) == (SAMPLE_RATE, CHANNELS):
+        return None
+    if to_codec:
+        return AudioConverter(samplerate, channels, SAMPLE_RATE, CHANNELS, chunk_size=CHUNK_SIZE)
+    return AudioConverter(SAMPLE_RATE, CHANNELS, samplerate, channels)
+
+def open_audio_streams():
+    """
+    Sets up the codec and opens, starts and primes the audio streams.
+    Blocking (PortAudio device warm-up can take a noticeable time), so main_client
+    runs it in a worker thread while the TCP handshake is in flight.
+    Returns (input_stream, output_stream). Raises if the devices can't be opened.
+    """
+    global input_converter, output_converter
+    import sounddevice as sd
 
-    # --- TCP Connection to Server ---
-    try:
-        reader, writer = await asyncio.open_connection(server_ip, server_port_tcp)
-        print(f"Connected to server {server_ip}:{server_port_tcp} via TCP.", flush=True)
+    init_codec()
 
-        # Send our UDP audio port to the server
-        writer.write(f"AUDIO_PORT:{client_udp_port}\n".encode())
-        await writer.drain()
+    # Open the devices at their native rate/channel count and convert in audio_utils,
+    # rather than making PortAudio or the OS resample (extra latency, and fails on some hardware).
+    input_rate, input_channels = query_device_format(sd, 'input')
+    output_rate, output_channels = query_device_format(sd, 'output')
+    input_converter = make_converter((input_rate, input_channels), to_codec=True)
+    output_converter = make_converter((output_rate, output_channels), to_codec=False)
+    if input_converter or output_converter:
+        print(f"Converting audio: input {input_rate} Hz x{input_channels}, output {output_rate} Hz x{output_channels}, "
+              f"codec {SAMPLE_RATE} Hz x{CHANNELS}", flush=True)
 
-        response = await reader.read(100)
-        if response.decode().strip() == "AUDIO_OK":
-            print("Server acknowledged UDP audio port.", flush=True)
-        else:
-            print("Server did NOT acknowledge UDP audio port. Exiting.", flush=True)
-            client_udp_socket.close()
-            writer.close()
-            await writer.wait_closed()
-            return
-    except ConnectionRefusedError:
-        print(f"Connection refused by server {server_ip}:{server_port_tcp}. Is it running?", flush=True)
-        client_udp_socket.close()
-        return
-    except Exception as e:
-        print(f"Failed to connect to server or register audio port: {e}", flush=True)
-        client_udp_socket.close()
-        return
-
-    # --- Setup Audio Streams (Input and Output) ---
     # Using a callback for input, and direct play for output.
     # dtype='float32' is standard for sounddevice and works well with NumPy.
+    input_stream = None
+    output_stream = None
     try:
         # Input stream (microphone)
         input_stream = sd.InputStream(
-            samplerate=SAMPLE_RATE,
-            channels=CHANNELS,
+            samplerate=input_rate,
+            channels=input_channels,
             dtype='float32',
-            blocksize=CHUNK_SIZE, # This is frames per buffer
+            blocksize=round(CHUNK_SIZE * input_rate / SAMPLE_RATE), # Frames per buffer: same 20 ms at the native rate
             callback=audio_input_callback
         )
         # Output stream (speakers)
         output_stream = sd.OutputStream(
-            samplerate=SAMPLE_RATE,
-            channels=CHANNELS,
+            samplerate=output_rate,
+            channels=output_channels,
             dtype='float32',
-            blocksize=CHUNK_SIZE # This is frames per buffer
+            blocksize=round(CHUNK_SIZE * output_rate / SAMPLE_RATE) # Frames per buffer
         )
+        # Starting the input stream early also fills the pre-roll buffer before the first PTT press
         input_stream.start()
         output_stream.start()
-        print("Audio input and output streams started.", flush=True)
-    except Exception as e:
-        print(f"Error starting audio streams: {e}", flush=True)
-        print("Make sure you have a working microphone and speaker configuration.", flush=True)
-        # Attempt to clean up network connections before exiting
-        writer.write("QUIT\n".encode()) # Inform server
-        await writer.drain()
-        writer.close()
-        await writer.wait_closed()
-        client_udp_socket.close()
-        return
+        # Prime the output device with a block of silence so the first received packet doesn't wait on warm-up
+        output_stream.write(np.zeros((output_stream.blocksize, output_channels), dtype=np.float32))
+        device_latency_ms['output_device'] = output_stream.latency * 1000
+    except Exception:
+        close_audio_streams(input_stream, output_stream)
+        raise
+    return input_stream, output_stream
+
+def close_audio_streams(input_stream, output_stream):
+    if input_stream:
+        input_stream.stop()
+        input_stream.close()
+        print("Audio input stream stopped and closed.", flush=True)
+    if output_stream:
+        output_stream.stop()
+        output_stream.close()
+        print("Audio output stream stopped and closed.", flush=True)
+
+def close_pending_audio_streams(audio_setup):
+    """
+    Waits for an in-flight open_audio_streams() call (a concurrent.futures.Future) and closes
+    whatever it opened. Used whenever main_client exits before taking over the streams,
+    including Ctrl+C/cancellation during the handshake. Blocks briefly instead of awaiting,
+    so a second cancellation can't leave the devices open. If the device is still opening
+    after AUDIO_SETUP_TIMEOUT seconds, the streams are closed from the worker thread once
+    it finishes rather than holding up shutdown.
+    """
+    try:
+        close_audio_streams(*audio_setup.result(timeout=AUDIO_SETUP_TIMEOUT))
+    except FutureTimeoutError:
+        print(f"Audio devices still opening after {AUDIO_SETUP_TIMEOUT}s; they will be closed when ready.", flush=True)
+        audio_setup.add_done_callback(close_pending_audio_streams)
+    except BaseException:
+        pass # Device setup failed or never ran; nothing to close
+
+async def main_client(server_ip, server_port_tcp):
+    global loop
+    loop = asyncio.get_running_loop() # Get the loop for this async context
 
+    # --- Setup Audio Streams (Input and Output) ---
+    # Opened in a worker thread in parallel with the PTT/UDP setup and TCP handshake below.
+    audio_executor = ThreadPoolExecutor(max_workers=1)
+    audio_setup = audio_executor.submit(open_audio_streams)
+    audio_executor.shutdown(wait=False) # The worker thread exits once the setup call is done
+    keyboard = None
+    client_udp_socket = None
+    streams_ready = False
+
+    try:
+        # --- Setup PTT ---
+        # keyboard.on_press_key(PTT_KEY, lambda _: ptt_on(), suppress=False)
+        # keyboard.on_release_key(PTT_KEY, lambda _: ptt_off(), suppress=False)
+        # Using keyboard.add_hotkey for better PTT semantics (triggers once on press/release)
+        try:
+            import keyboard # For PTT; optional, the client still receives audio without it
+            keyboard.add_hotkey(PTT_KEY, ptt_on, suppress=False, trigger_on_release=False)
+            keyboard.add_hotkey(PTT_KEY, ptt_off, suppress=False, trigger_on_release=True)
+            print(f"PTT enabled. Press and hold '{PTT_KEY}' to talk.", flush=True)
+        except Exception as e:
+            print(f"Could not set up PTT hotkey '{PTT_KEY}'. Is 'sudo' required or is the key name correct? Error: {e}", flush=True)
+            print("PTT will NOT work. You may need to run as root or configure input permissions.", flush=True)
+
+
+        # --- Setup UDP socket for audio ---
+        # Create UDP socket for sending and receiving audio
+        # Client needs to pick a free UDP port.
+        client_udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        client_udp_socket.bind(('', 0)) # Bind to any available local port
+        client_udp_port = client_udp_socket.getsockname()[1]
+        print(f"Client UDP audio endpoint: {client_udp_socket.getsockname()}", flush=True)
+
+        server_audio_port_udp = server_port_tcp + AUDIO_PORT_OFFSET
+        server_audio_addr = (server_ip, server_audio_port_udp)
+
+        # Make server_audio_addr available to the audio_input_callback
+        audio_input_callback.udp_socket = client_udp_socket
+        audio_input_callback.server_audio_addr = server_audio_addr
+
+
+        # --- TCP Connection to Server ---
+        try:
+            reader, writer = await asyncio.open_connection(server_ip, server_port_tcp)
+            print(f"Connected to server {server_ip}:{server_port_tcp} via TCP.", flush=True)
+
+            # Send our UDP audio port to the server
+            writer.write(f"AUDIO_PORT:{client_udp_port}\n".encode())
+            await writer.drain()
+
+            response = await reader.read(100)
+            if response.decode().strip() == "AUDIO_OK":
+                print("Server acknowledged UDP audio port.", flush=True)
+            else:
+                print("Server did NOT acknowledge UDP audio port. Exiting.", flush=True)
+                client_udp_socket.close()
+                writer.close()
+                await writer.wait_closed()
+                return
+        except ConnectionRefusedError:
+            print(f"Connection refused by server {server_ip}:{server_port_tcp}. Is it running?", flush=True)
+            client_udp_socket.close()
+            return
+        except Exception as e:
+            print(f"Failed to connect to server or register audio port: {e}", flush=True)
+            client_udp_socket.close()
+            return
+
+        # --- Wait for the Audio Streams opened during the handshake ---
+        try:
+            input_stream, output_stream = await asyncio.wrap_future(audio_setup)
+            streams_ready = True
+            print("Audio input and output streams started.", flush=True)
+        except Exception as e:
+            print(f"Error starting audio streams: {e}", flush=True)
+            print("Make sure you have a working microphone and speaker configuration.", flush=True)
+            # Attempt to clean up network connections before exiting
+            writer.write("QUIT\n".encode()) # Inform server
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+            client_udp_socket.close()
+            return
+    finally:
+        # Any exit before the streams are handed over (errors, Ctrl+C, cancellation)
+        # must not leave the pre-warmed devices open.
+        if not streams_ready:
+            close_pending_audio_streams(audio_setup)
+            if client_udp_socket:
+                client_udp_socket.close() # No-op if an error path above already closed it
 
     # --- Main Client Loop ---
     # Create task for listening to incoming audio
@@ -217,21 +408,14 @@ async def main_client(server_ip, server_port_tcp):
         print("Shutting down client...", flush=True)
         shutdown_event.set() # Signal all tasks to stop
 
-        if 'keyboard' in globals() and PTT_KEY:
+        if keyboard and PTT_KEY:
             try:
                 keyboard.remove_all_hotkeys() # Clean up PTT hooks
                 print("PTT hotkeys removed.", flush=True)
             except Exception as e:
                 print(f"Error removing PTT hotkeys: {e}", flush=True)
 
-        if 'input_stream' in locals() and input_stream:
-            input_stream.stop()
-            input_stream.close()
-            print("Audio input stream stopped and closed.", flush=True)
-        if 'output_stream' in locals() and output_stream:
-            output_stream.stop()
-            output_stream.close()
-            print("Audio output stream stopped and closed.", flush=True)
+        close_audio_streams(input_stream, output_stream)
 
         if 'audio_listener_task' in locals() and audio_listener_task:
             audio_listener_task.cancel()
@@ -269,6 +453,9 @@ if __name__ == "__main__":
     parser.add_argument("server_ip", help="IP address of the server")
     parser.add_argument("-p", "--port", type=int, default=DEFAULT_SERVER_PORT,
                         help=f"TCP port of the server (default: {DEFAULT_SERVER_PORT})")
+    parser.add_argument("--profile", nargs="?", const="lanchat-client.prof", metavar="STATS_FILE",
+                        help="Trace per-stage latency and profile the client; prints a report and "
+                             "saves profiler stats on exit (default file: lanchat-client.prof)")
     args = parser.parse_args()
 
     print("Client application starting...", flush=True)
@@ -276,6 +463,9 @@ if __name__ == "__main__":
     # print(f"Default input device: {sd.default.device[0]}, Default output device: {sd.default.device[1]}", flush=True)
 
 
+    if args.profile:
+        profiling.start()
+
     try:
         asyncio.run(main_client(args.server_ip, args.port))
     except KeyboardInterrupt:
@@ -289,4 +479,6 @@ if __name__ == "__main__":
         # This is tricky because keyboard hooks might be in a different thread
         # and rely on the main loop running for their context in some cases.
         # The `finally` in `main_client` is the preferred place for this.
+        if args.profile:
+            profiling.stop(args.profile, device_latency_ms)
         print("Client application finished.", flush=True)
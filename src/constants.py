@@ -10,3 +10,5 @@ CHANNELS = 1         # Mono
 CHUNK_SIZE = 960     # Samples per frame (20ms at 48kHz) Opus preferred frame sizes: 2.5, 5, 10, 20, 40, 60 ms
                      # For 48000 Hz, 20ms = 48000 * 0.020 = 960 samples
 PTT_KEY = 'ctrl_r'   # Default Push-to-Talk key (using keyboard library names)
+PREROLL_MS = 100     # Microphone audio kept from just before PTT is pressed, sent at the start of each transmission
+AUDIO_SETUP_TIMEOUT = 5.0 # Seconds to wait for a still-opening audio device when the client exits early
@@ -0,0 +1,63 @@
+# LAN Voice Chat - Packet trace capture format
+#
+# A trace is a small header followed by one record per received audio datagram:
+#   MAGIC (8 bytes)
+#   then per packet: timestamp_ns (uint64), sender IPv4 (4 bytes), sender port (uint16),
+#                    payload size (uint16), flags (uint8), payload (size bytes)
+# All integers are big-endian. Timestamps are nanoseconds since the capture started.
+import socket
+import struct
+import time
+
+TRACE_MAGIC = b'LCTRACE2'
+RECORD_HEADER = struct.Struct('!Q4sHHB')
+FLAG_KNOWN_SENDER = 0x01 # The sender was a registered client, so the relay forwarded the packet
+
+class TraceWriter:
+    """
+    Appends received datagrams to a binary trace file.
+    Writes go through a buffered file so capturing adds little work to the relay path.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(TRACE_MAGIC)
+        self.start_ns = time.monotonic_ns()
+        self.packet_count = 0
+
+    def write(self, addr, data, known_sender):
+        """
+        Records one datagram received from addr (ip, port) now.
+        known_sender: whether the relay matched addr to a registered client (unknown sources are dropped).
+        """
+        timestamp_ns = time.monotonic_ns() - self.start_ns
+        flags = FLAG_KNOWN_SENDER if known_sender else 0
+        self.file.write(RECORD_HEADER.pack(timestamp_ns, socket.inet_aton(addr[0]), addr[1], len(data), flags))
+        self.file.write(data)
+        self.packet_count += 1
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+            print(f"Packet trace closed: {self.packet_count} packets written to {self.path}")
+
+def read_trace(path):
+    """
+    Yields (timestamp_seconds, sender_addr, payload, known_sender) for each record in a trace file.
+    Raises ValueError if the file isn't a trace or is truncated mid-record.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError(f"{path} is not a packet trace (bad header).")
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if not header:
+                return
+            if len(header) < RECORD_HEADER.size:
+                raise ValueError(f"{path} is truncated (partial record header).")
+            timestamp_ns, ip, port, size, flags = RECORD_HEADER.unpack(header)
+            payload = f.read(size)
+            if len(payload) < size:
+                raise ValueError(f"{path} is truncated (partial payload).")
+            yield timestamp_ns / 1e9, (socket.inet_ntoa(ip), port), payload, bool(flags & FLAG_KNOWN_SENDER)
@@ -0,0 +1,169 @@
+# LAN Voice Chat - Profiling hooks and per-stage latency tracing
+#
+# Disabled by default: every hook in the audio path is guarded by `if profiling.enabled`,
+# so the only cost when off is an attribute check. Enabled with --profile on the client/server,
+# which also runs cProfile (or yappi, if installed, to include the audio callback threads)
+# and prints a per-stage latency breakdown on exit.
+#
+# While profiling, a client prefixes each audio packet with its capture time so receivers
+# (and the relay) can measure network + relay delay. Comparing timestamps across machines
+# assumes their clocks are synchronized (e.g. NTP); on one host they are exact.
+import struct
+import time
+
+enabled = False
+
+# Pipeline order, used for the report. Stages never recorded are left out.
+STAGE_ORDER = (
+    'capture',       # ADC -> input callback (sounddevice block)
+    'encode',        # encode_audio
+    'send',          # sendto on the client
+    'network_in',    # ADC -> server receive (server side)
+    'relay',         # ServerAudioProtocol fan-out
+    'network',       # ADC -> client receive: includes capture, encode, send and relay
+    'decode',        # decode_audio
+    'convert',       # AudioConverter on playback
+    'playout_write', # output_stream.write (blocks while the device buffer is full)
+)
+# Stages summed for the mouth-to-ear estimate. Packets are stamped with their ADC time,
+# so 'network' already covers capture/encode/send on the sender; those aren't added again.
+MOUTH_TO_EAR_STAGES = ('network', 'decode', 'convert', 'playout_write')
+
+TIMESTAMP_MAGIC = b'LCts'
+TIMESTAMP_HEADER = struct.Struct('!4sQ')
+
+class LatencyHistogram:
+    """
+    Fixed-size histogram with power-of-two microsecond buckets.
+    Recording is a few integer operations, cheap enough for the audio callback threads.
+    Bucket i holds samples in [2**(i-1), 2**i) microseconds; bucket 0 holds < 1 us.
+    """
+    NUM_BUCKETS = 32
+
+    def __init__(self):
+        self.buckets = [0] * self.NUM_BUCKETS
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def record(self, duration_ns):
+        duration_ns = max(0, duration_ns)
+        self.buckets[min((duration_ns // 1000).bit_length(), self.NUM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total_ns += duration_ns
+        if duration_ns > self.max_ns:
+            self.max_ns = duration_ns
+
+    def mean_ms(self):
+        return self.total_ns / self.count / 1e6 if self.count else 0.0
+
+    def percentile_ms(self, percentile):
+        """Upper bound of the bucket holding the given percentile (0-100), capped at the max seen."""
+        if not self.count:
+            return 0.0
+        target = self.count * percentile / 100.0
+        seen = 0
+        for i, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= target:
+                return min((1 << i) / 1e3, self.max_ns / 1e6)
+        return self.max_ns / 1e6
+
+histograms = {} # stage name -> LatencyHistogram
+# Set when the input host API gives no ADC timestamps, so packets are dated at callback entry
+adc_time_unavailable = False
+_profiler = None
+_profiler_backend = None
+
+def record(stage, duration_ns):
+    """Adds one latency sample (nanoseconds) for stage."""
+    histogram = histograms.get(stage)
+    if histogram is None:
+        histogram = histograms.setdefault(stage, LatencyHistogram())
+    histogram.record(duration_ns)
+
+def record_since(stage, start_ns):
+    """Records the time elapsed since start_ns (a time.perf_counter_ns() value)."""
+    record(stage, time.perf_counter_ns() - start_ns)
+
+def stamp_packet(data, capture_time_ns):
+    """Prefixes an audio packet with its capture time (time.time_ns() clock)."""
+    return TIMESTAMP_HEADER.pack(TIMESTAMP_MAGIC, capture_time_ns) + data
+
+def unstamp_packet(data):
+    """
+    Splits a possibly stamped packet into (payload, capture_time_ns or None).
+    Unstamped packets are returned unchanged, so receivers can always call this.
+    """
+    if data[:len(TIMESTAMP_MAGIC)] != TIMESTAMP_MAGIC or len(data) < TIMESTAMP_HEADER.size:
+        return data, None
+    _, capture_time_ns = TIMESTAMP_HEADER.unpack_from(data)
+    return data[TIMESTAMP_HEADER.size:], capture_time_ns
+
+def start():
+    """Enables the latency hooks and starts yappi (if installed) or cProfile."""
+    global enabled, _profiler, _profiler_backend, adc_time_unavailable
+    histograms.clear()
+    adc_time_unavailable = False
+    try:
+        import yappi
+        yappi.set_clock_type('wall')
+        yappi.start()
+        _profiler, _profiler_backend = yappi, 'yappi'
+    except ImportError:
+        import cProfile
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+        _profiler_backend = 'cProfile'
+    enabled = True
+
+def stop(stats_path, extra_latency_ms=None):
+    """
+    Stops profiling, prints the per-stage latency report and the top profiled functions,
+    and saves the profile to stats_path (pstats format, readable with `python -m pstats`).
+    extra_latency_ms: optional {label: ms} of fixed latencies (e.g. device buffers) to include.
+    """
+    global enabled, _profiler, _profiler_backend
+    if not enabled:
+        return
+    enabled = False
+
+    import pstats
+    if _profiler_backend == 'yappi':
+        _profiler.stop()
+        _profiler.get_func_stats().save(stats_path, type='pstat')
+        stats = pstats.Stats(stats_path)
+    else:
+        _profiler.disable()
+        _profiler.dump_stats(stats_path)
+        stats = pstats.Stats(_profiler)
+    _profiler = None
+
+    print_latency_report(extra_latency_ms)
+    print(f"\n{_profiler_backend} output saved to {stats_path}. Top functions by cumulative time:")
+    stats.sort_stats('cumulative').print_stats(15)
+
+def print_latency_report(extra_latency_ms=None):
+    print("\nPer-stage latency (ms):")
+    print(f"{'stage':<14} {'count':>8} {'mean':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    names = [name for name in STAGE_ORDER if name in histograms]
+    names += sorted(name for name in histograms if name not in STAGE_ORDER)
+    for name in names:
+        h = histograms[name]
+        print(f"{name:<14} {h.count:>8} {h.mean_ms():>8.2f} {h.percentile_ms(50):>8.2f} "
+              f"{h.percentile_ms(95):>8.2f} {h.percentile_ms(99):>8.2f} {h.max_ns / 1e6:>8.2f}")
+    for label, latency_ms in (extra_latency_ms or {}).items():
+        print(f"{label:<14} {'':>8} {latency_ms:>8.2f}")
+
+    if 'network' not in histograms:
+        # Without it the sum would be decode/playout alone, far below the real figure
+        if any(name in histograms for name in MOUTH_TO_EAR_STAGES):
+            print("Estimated mouth-to-ear: unavailable (no 'network' samples: no timestamped packets "
+                  "were received from a sender running with --profile)")
+        return
+    estimate = sum(histograms[name].mean_ms() for name in MOUTH_TO_EAR_STAGES if name in histograms)
+    estimate += sum((extra_latency_ms or {}).values())
+    print(f"Estimated mouth-to-ear (mean): {estimate:.2f} ms")
+    if adc_time_unavailable:
+        print("  Note: the input host API reports no ADC timestamps; packets are dated at callback entry, "
+              "so the estimate excludes the sender's capture buffering.")
@@ -0,0 +1,219 @@
+# LAN Voice Chat - Packet trace replay
+#
+# Feeds a trace recorded with `python -m src.server --capture FILE` back through the
+# server relay (ServerAudioProtocol) and the client receive/decode path, and reports
+# per-stage latency/CPU and concealment events. Usage:
+#   python -m src.replay FILE              # as fast as possible
+#   python -m src.replay FILE --speed 1.0  # time-accurate (2.0 = twice real time, ...)
+import argparse
+import time
+import numpy as np
+
+from .constants import SAMPLE_RATE, CHUNK_SIZE
+from .audio_utils import decode_audio, init_codec
+from .packet_trace import read_trace
+from . import server, profiling
+
+FRAME_DURATION = CHUNK_SIZE / SAMPLE_RATE # Seconds of audio per packet
+# Gaps longer than this between packets from one sender are treated as the end of a talk spurt
+# (PTT released), not as lost packets.
+TALKSPURT_GAP = 0.25
+LOSS_SLACK_FRAMES = 0.1 # See settle_talk_spurt()
+
+# The replay listens as a client that never sends, so every relayed packet reaches it
+REPLAY_LISTENER_CONTROL_ADDR = ('replay-listener', 0)
+REPLAY_LISTENER_AUDIO_ADDR = ('0.0.0.0', 0)
+
+class RecordingTransport:
+    """Stands in for the server's UDP transport and keeps what the relay sends."""
+
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, addr):
+        self.sent.append((data, addr))
+
+class StageStats:
+    """Wall-clock samples and CPU time for one pipeline stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.samples_ns = []
+        self.cpu_ns = 0
+
+    def add(self, wall_ns, cpu_ns):
+        self.samples_ns.append(wall_ns)
+        self.cpu_ns += cpu_ns
+
+    def summary(self):
+        samples = sorted(self.samples_ns)
+        if not samples:
+            return {'count': 0, 'cpu_ms': 0.0, 'mean_us': 0.0, 'p95_us': 0.0, 'max_us': 0.0}
+        return {
+            'count': len(samples),
+            'cpu_ms': self.cpu_ns / 1e6,
+            'mean_us': sum(samples) / len(samples) / 1e3,
+            'p95_us': samples[min(len(samples) - 1, int(len(samples) * 0.95))] / 1e3,
+            'max_us': samples[-1] / 1e3,
+        }
+
+def timed(stage, func, *args):
+    """Runs func(*args), adding its wall and CPU time to stage. Returns func's result."""
+    start_wall = time.perf_counter_ns()
+    start_cpu = time.thread_time_ns()
+    result = func(*args)
+    stage.add(time.perf_counter_ns() - start_wall, time.thread_time_ns() - start_cpu)
+    return result
+
+def settle_talk_spurt(arrivals):
+    """
+    Estimates packet loss in one sender's finished talk spurt from arrival times alone
+    (packets carry no sequence numbers). Returns (concealment_events, lost_frames).
+
+    The sender produces one packet per FRAME_DURATION, so packet k of a loss-free spurt is due
+    at anchor + k * FRAME_DURATION, with the anchor taken from the least-delayed packet. Each lost
+    frame makes every later packet one frame later. A delay spike only makes a few packets late:
+    once the held packets arrive bunched together, the following ones are back on time. So a
+    packet's deficit (whole frames late) only counts if no later packet in the spurt is less late
+    (suffix minimum). The last packet has no later one to confirm it, so it needs the packet
+    before it to agree.
+    """
+    lateness = np.array(arrivals) - np.arange(len(arrivals)) * FRAME_DURATION
+    # Slack: after a loss, a packet can be slightly less delayed than the anchor (and ns timestamps
+    # make whole frames 0.99999...), which must not read as one frame fewer.
+    deficits = np.floor((lateness - lateness.min()) / FRAME_DURATION + LOSS_SLACK_FRAMES).astype(int)
+    if len(deficits) > 1:
+        deficits[-1] = min(deficits[-1], deficits[-2])
+    deficits = np.minimum.accumulate(deficits[::-1])[::-1] # Suffix minimum
+    return int(np.count_nonzero(np.diff(deficits))), int(deficits[-1])
+
+def track_talk_spurt(talk_spurts, addr, timestamp):
+    """
+    Adds a packet to its sender's current talk spurt (a list of arrival times). Returns the
+    arrival times of the spurt that just ended if this packet starts a new one, otherwise None.
+    """
+    spurt = talk_spurts.get(addr)
+    if spurt and timestamp - spurt[-1] <= TALKSPURT_GAP:
+        spurt.append(timestamp)
+        return None
+    talk_spurts[addr] = [timestamp]
+    return spurt
+
+def add_talk_spurt_loss(report, arrivals):
+    events, lost_frames = settle_talk_spurt(arrivals)
+    report['concealment_events'] += events
+    report['concealed_frames'] += lost_frames
+
+def replay_trace(path, speed=0.0):
+    """
+    Replays a packet trace and returns a report dict.
+    speed: 0 replays as fast as possible; otherwise packets are delivered at their
+           recorded times divided by speed (1.0 = real time) and lateness is measured.
+    """
+    init_codec()
+    records = list(read_trace(path))
+
+    protocol = server.ServerAudioProtocol(None)
+    transport = RecordingTransport()
+    protocol.connection_made(transport)
+
+    stages = {name: StageStats(name) for name in ('relay', 'decode', 'pipeline')}
+    lateness = StageStats('lateness')
+    last_packet_time = {} # sender addr -> timestamp of its previous packet
+    talk_spurts = {} # sender addr -> arrival times in its current talk spurt
+    report = {
+        'packets': len(records),
+        'senders': 0,
+        'duration_s': records[-1][0] - records[0][0] if records else 0.0,
+        'unknown_packets': 0,
+        'relayed_packets': 0,
+        'decode_errors': 0,
+        'concealment_events': 0,
+        'concealed_frames': 0,
+        'talk_over_packets': 0,
+    }
+
+    # Register every sender the live relay knew, plus the replay listener, as connected clients.
+    # The relay works on the module-level client table, so save and restore it.
+    saved_clients = dict(server.clients_udp_audio)
+    server.clients_udp_audio.clear()
+    for _, addr, _, known_sender in records:
+        if known_sender:
+            server.clients_udp_audio[addr] = addr
+    report['senders'] = len(server.clients_udp_audio)
+    server.clients_udp_audio[REPLAY_LISTENER_CONTROL_ADDR] = REPLAY_LISTENER_AUDIO_ADDR
+
+    try:
+        replay_start = time.perf_counter()
+        first_timestamp = records[0][0] if records else 0.0
+        for timestamp, addr, data, known_sender in records:
+            due = replay_start + (timestamp - first_timestamp) / speed if speed > 0 else None
+            if due is not None:
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+            if known_sender:
+                # Loss and talk-over, judged from the recorded arrival times
+                ended_spurt = track_talk_spurt(talk_spurts, addr, timestamp)
+                if ended_spurt:
+                    add_talk_spurt_loss(report, ended_spurt)
+                if any(other != addr and timestamp - t < FRAME_DURATION for other, t in last_packet_time.items()):
+                    report['talk_over_packets'] += 1
+                last_packet_time[addr] = timestamp
+            else:
+                # The live relay didn't know this sender at the time (not registered yet, or already gone)
+                report['unknown_packets'] += 1
+                registered_addr = server.clients_udp_audio.pop(addr, None)
+
+            pipeline_start_wall = time.perf_counter_ns()
+            pipeline_start_cpu = time.thread_time_ns()
+            transport.sent.clear()
+            timed(stages['relay'], protocol.datagram_received, data, addr)
+            if not known_sender and registered_addr:
+                server.clients_udp_audio[addr] = registered_addr
+            for relayed, target in transport.sent:
+                if target != REPLAY_LISTENER_AUDIO_ADDR:
+                    continue
+                report['relayed_packets'] += 1
+                relayed, _ = profiling.unstamp_packet(relayed) # Captured from a --profile client
+                decoded = timed(stages['decode'], decode_audio, relayed)
+                if decoded.size == 0:
+                    report['decode_errors'] += 1
+                    report['concealment_events'] += 1
+                    report['concealed_frames'] += 1
+            stages['pipeline'].add(time.perf_counter_ns() - pipeline_start_wall,
+                                   time.thread_time_ns() - pipeline_start_cpu)
+            if due is not None:
+                lateness.add(max(0, int((time.perf_counter() - due) * 1e9)), 0)
+        report['replay_wall_s'] = time.perf_counter() - replay_start
+        for spurt in talk_spurts.values(): # Talk spurts still open at the end of the trace
+            add_talk_spurt_loss(report, spurt)
+    finally:
+        server.clients_udp_audio.clear()
+        server.clients_udp_audio.update(saved_clients)
+
+    if speed > 0:
+        stages['lateness'] = lateness
+    report['stages'] = {name: stage.summary() for name, stage in stages.items()}
+    return report
+
+def print_report(report):
+    print(f"Packets: {report['packets']} from {report['senders']} sender(s) over {report['duration_s']:.2f} s "
+          f"(replayed in {report['replay_wall_s']:.2f} s)")
+    print(f"Relayed to listener: {report['relayed_packets']}, decode errors: {report['decode_errors']}, "
+          f"dropped from unknown senders: {report['unknown_packets']}")
+    print(f"Concealment events: {report['concealment_events']} ({report['concealed_frames']} frames), "
+          f"talk-over packets: {report['talk_over_packets']}")
+    print(f"{'stage':<10} {'count':>8} {'cpu ms':>10} {'mean us':>10} {'p95 us':>10} {'max us':>10}")
+    for name, s in report['stages'].items():
+        print(f"{name:<10} {s['count']:>8} {s['cpu_ms']:>10.2f} {s['mean_us']:>10.1f} {s['p95_us']:>10.1f} {s['max_us']:>10.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a LAN Voice Chat packet trace")
+    parser.add_argument("trace_file", help="Trace recorded with the server's --capture option")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="Playback speed relative to real time; 0 (default) replays as fast as possible")
+    args = parser.parse_args()
+
+    print_report(replay_trace(args.trace_file, args.speed))
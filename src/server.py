@@ -1,6 +1,10 @@
 import asyncio
 import socket
+import argparse
+from time import perf_counter_ns, time_ns
 from .constants import DEFAULT_SERVER_IP, DEFAULT_SERVER_PORT, AUDIO_PORT_OFFSET
+from .packet_trace import TraceWriter
+from . import profiling
 
 # Using a set for clients for efficient add/remove operations.
 # Stores (writer, address) tuples for TCP control connections
@@ -9,9 +13,10 @@ clients_tcp = {} # Maps client address (ip, port) to their asyncio StreamWriter
 clients_udp_audio = {} # Maps client control address (ip, tcp_port) to their audio address (ip, udp_port)
 
 class ServerAudioProtocol(asyncio.DatagramProtocol):
-    def __init__(self, server):
+    def __init__(self, server, trace_writer=None):
         self.server = server
         self.transport = None
+        self.trace_writer = trace_writer # Optional TraceWriter recording every received datagram
 
     def connection_made(self, transport):
         self.transport = transport
@@ -20,6 +25,12 @@ class ServerAudioProtocol(asyncio.DatagramProtocol):
     def datagram_received(self, data, addr):
         # When audio data is received from a client, broadcast it to all other clients.
         # print(f"Audio data received from {addr}: {len(data)} bytes")
+        profile = profiling.enabled
+        if profile:
+            start_ns = perf_counter_ns()
+            _, capture_time_ns = profiling.unstamp_packet(data)
+            if capture_time_ns is not None:
+                profiling.record('network_in', time_ns() - capture_time_ns)
 
         # Identify the sender based on their audio address
         sender_control_addr = None
@@ -28,6 +39,10 @@ class ServerAudioProtocol(asyncio.DatagramProtocol):
                 sender_control_addr = control_addr
                 break
 
+        if self.trace_writer:
+            # Unknown sources are captured too, flagged so a replay drops them like the relay did
+            self.trace_writer.write(addr, data, known_sender=sender_control_addr is not None)
+
         if not sender_control_addr:
             # print(f"Warning: Received audio from unknown source {addr}")
             return
@@ -36,6 +51,8 @@ class ServerAudioProtocol(asyncio.DatagramProtocol):
             if audio_addr_target != addr: # Don't send audio back to the sender
                 # print(f"Relaying audio from {sender_control_addr} to {control_addr} via {audio_addr_target}")
                 self.transport.sendto(data, audio_addr_target)
+        if profile:
+            profiling.record_since('relay', start_ns)
 
     def error_received(self, exc):
         print(f"Audio UDP socket error: {exc}")
@@ -99,7 +116,7 @@ async def handle_client_tcp(reader, writer):
         await writer.wait_closed()
         # Inform other clients about disconnection? (Future enhancement)
 
-async def main():
+async def main(capture_path=None):
     loop = asyncio.get_running_loop()
 
     # Start TCP server for control messages
@@ -113,10 +130,15 @@ async def main():
     # The audio port is derived from the TCP port for simplicity
     audio_server_port = DEFAULT_SERVER_PORT + AUDIO_PORT_OFFSET
 
+    # Optional packet capture for later replay (see src/replay.py)
+    trace_writer = TraceWriter(capture_path) if capture_path else None
+    if trace_writer:
+        print(f"Capturing audio packets to {capture_path}")
+
     # Pass 'server_instance' if ServerAudioProtocol needs to access server's state directly
     # For now, it's self-contained enough or uses global `clients_udp_audio`
     transport_udp, protocol_udp = await loop.create_datagram_endpoint(
-        lambda: ServerAudioProtocol(None), # Pass server instance if needed
+        lambda: ServerAudioProtocol(None, trace_writer), # Pass server instance if needed
         local_addr=(DEFAULT_SERVER_IP, audio_server_port)
     )
     print(f"UDP Audio Server listening on {DEFAULT_SERVER_IP}:{audio_server_port}")
@@ -128,6 +150,8 @@ async def main():
             print("Server shutting down...")
         finally:
             transport_udp.close()
+            if trace_writer:
+                trace_writer.close()
             # Clean up TCP connections
             for addr, writer in list(clients_tcp.items()):
                 writer.close()
@@ -140,10 +164,23 @@ async def main():
             print("Server shutdown complete.")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LAN Voice Chat Server")
+    parser.add_argument("--capture", metavar="TRACE_FILE",
+                        help="Record all received audio packets to a binary trace file for replay")
+    parser.add_argument("--profile", nargs="?", const="lanchat-server.prof", metavar="STATS_FILE",
+                        help="Trace relay latency and profile the server; prints a report and "
+                             "saves profiler stats on exit (default file: lanchat-server.prof)")
+    args = parser.parse_args()
+
     print("Server application starting...")
+    if args.profile:
+        profiling.start()
     try:
-        asyncio.run(main())
+        asyncio.run(main(args.capture))
     except KeyboardInterrupt:
         print("Server process interrupted by user.")
     except Exception as e:
         print(f"Server failed to start or run: {e}")
+    finally:
+        if args.profile:
+            profiling.stop(args.profile)
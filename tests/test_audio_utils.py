@@ -11,6 +11,7 @@ import os # Ensure os is imported if not already
 # Adjust path to import from parent directory (project root)
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+au.init_codec() # Codec construction is deferred to session setup; do it up front for these tests
 from src.audio_utils import encode_audio, decode_audio, opus_encoder, opus_decoder # type: ignore
 from src.constants import CHUNK_SIZE, SAMPLE_RATE, CHANNELS # type: ignore
 
@@ -115,5 +116,77 @@ class TestAudioUtils(unittest.TestCase):
             self.skipTest("Skipping invalid data test for fallback decode, focus is on Opus behavior.")
 
 
+class TestAudioConverter(unittest.TestCase):
+
+    def make_sine(self, rate, seconds, frequency=1000, channels=1):
+        t = np.arange(int(rate * seconds)) / rate
+        tone = (0.5 * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+        return np.repeat(tone[:, None], channels, axis=1)
+
+    def test_passthrough_in_codec_format(self):
+        """No conversion is applied when the device already runs in the codec format."""
+        converter = au.AudioConverter(SAMPLE_RATE, CHANNELS, SAMPLE_RATE, CHANNELS, chunk_size=CHUNK_SIZE)
+        block = self.make_sine(SAMPLE_RATE, CHUNK_SIZE / SAMPLE_RATE, channels=CHANNELS)
+        chunks = converter.convert_chunks(block)
+        self.assertEqual(len(chunks), 1)
+        np.testing.assert_array_equal(chunks[0], block)
+
+    def test_resample_44100_stereo_to_codec_format(self):
+        """44.1 kHz stereo capture becomes CHUNK_SIZE-frame chunks with the tone preserved."""
+        converter = au.AudioConverter(44100, 2, SAMPLE_RATE, CHANNELS, chunk_size=CHUNK_SIZE)
+        audio = self.make_sine(44100, 1.0, channels=2)
+        chunks = []
+        for start in range(0, len(audio), 882): # 20 ms device blocks
+            chunks += converter.convert_chunks(audio[start:start + 882])
+
+        self.assertEqual(len(chunks), SAMPLE_RATE // CHUNK_SIZE)
+        for chunk in chunks:
+            self.assertEqual(chunk.shape, (CHUNK_SIZE, CHANNELS))
+            self.assertEqual(chunk.dtype, np.float32)
+
+        output = np.concatenate(chunks)[CHUNK_SIZE:, 0] # Skip filter start-up
+        rms = np.sqrt(np.mean(output ** 2))
+        self.assertAlmostEqual(rms, 0.5 / np.sqrt(2), delta=0.01)
+        spectrum = np.abs(np.fft.rfft(output))
+        peak_hz = np.argmax(spectrum) * SAMPLE_RATE / len(output)
+        self.assertAlmostEqual(peak_hz, 1000, delta=5)
+
+    def test_filter_state_carries_across_blocks(self):
+        """Feeding audio in odd-sized blocks gives the same result as one big block."""
+        audio = self.make_sine(44100, 0.5)
+        whole = au.AudioConverter(44100, 1, SAMPLE_RATE, 1).convert(audio)
+        streaming = au.AudioConverter(44100, 1, SAMPLE_RATE, 1)
+        blocks = [streaming.convert(audio[start:start + 777]) for start in range(0, len(audio), 777)]
+        np.testing.assert_allclose(np.concatenate(blocks), whole, atol=1e-6)
+
+    def level_db(self, from_rate, to_rate, frequency):
+        """Level (dB relative to the input tone) of a tone after conversion, skipping filter start-up."""
+        converter = au.AudioConverter(from_rate, 1, to_rate, 1)
+        output = converter.convert(self.make_sine(from_rate, 0.5, frequency))[500:, 0]
+        return 20 * np.log10(np.sqrt(np.mean(output ** 2)) / (0.5 / np.sqrt(2)))
+
+    def test_downsampling_stopband_rejection(self):
+        """Tones above the output Nyquist frequency are filtered out instead of aliasing."""
+        for from_rate, to_rate, frequency in ((96000, 48000, 25000), (96000, 48000, 28000), (48000, 44100, 23000)):
+            with self.subTest(from_rate=from_rate, to_rate=to_rate, frequency=frequency):
+                self.assertLess(self.level_db(from_rate, to_rate, frequency), -60)
+        # Voice band passes unchanged, also when decimating by more than 2:1
+        self.assertGreater(self.level_db(96000, 48000, 8000), -0.5)
+        self.assertGreater(self.level_db(48000, 44100, 8000), -0.5)
+        for frequency in (3000, 8000, 12000):
+            with self.subTest(from_rate=192000, to_rate=48000, frequency=frequency):
+                self.assertGreater(self.level_db(192000, 48000, frequency), -0.5)
+        self.assertLess(self.level_db(192000, 48000, 26000), -60)
+
+    def test_playback_upmix_and_resample(self):
+        """Decoded mono 1-D codec audio is converted to the output device's format."""
+        converter = au.AudioConverter(SAMPLE_RATE, CHANNELS, 44100, 2)
+        decoded = self.make_sine(SAMPLE_RATE, 0.1)[:, 0]
+        output = converter.convert(decoded)
+        self.assertEqual(output.shape[1], 2)
+        self.assertAlmostEqual(len(output), 4410, delta=1)
+        np.testing.assert_array_equal(output[:, 0], output[:, 1])
+
+
 if __name__ == '__main__':
     unittest.main()
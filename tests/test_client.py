@@ -0,0 +1,134 @@
+import unittest
+import unittest.mock as mock
+import asyncio
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+import src.client as client
+from src.constants import CHUNK_SIZE, CHANNELS
+
+class TestPreroll(unittest.TestCase):
+
+    def setUp(self):
+        client.preroll_buffer.clear()
+        client.is_ptt_active = False
+        self.udp_socket = mock.Mock()
+        client.audio_input_callback.udp_socket = self.udp_socket
+        client.audio_input_callback.server_audio_addr = ('127.0.0.1', 12346)
+
+    def tearDown(self):
+        client.preroll_buffer.clear()
+        client.is_ptt_active = False
+        del client.audio_input_callback.udp_socket
+        del client.audio_input_callback.server_audio_addr
+
+    def make_chunk(self, value):
+        return np.full((CHUNK_SIZE, CHANNELS), value, dtype=np.float32)
+
+    def test_preroll_keeps_only_recent_chunks(self):
+        """While PTT is released nothing is sent and only the last PREROLL_CHUNKS are kept."""
+        for i in range(client.PREROLL_CHUNKS + 3):
+            client.audio_input_callback(self.make_chunk(i / 100), CHUNK_SIZE, None, None)
+        self.udp_socket.sendto.assert_not_called()
+        self.assertEqual(len(client.preroll_buffer), client.PREROLL_CHUNKS)
+        self.assertAlmostEqual(float(client.preroll_buffer[0][0, 0]), 3 / 100, places=6)
+
+    def test_preroll_copies_input_buffer(self):
+        """sounddevice reuses its buffer, so the pre-roll must hold copies."""
+        indata = self.make_chunk(0.25)
+        client.audio_input_callback(indata, CHUNK_SIZE, None, None)
+        indata[:] = 0.0
+        self.assertAlmostEqual(float(client.preroll_buffer[0][0, 0]), 0.25, places=6)
+
+    def test_preroll_sent_before_live_audio(self):
+        """The first chunk after PTT engages is preceded by the buffered pre-roll."""
+        for i in range(client.PREROLL_CHUNKS):
+            client.audio_input_callback(self.make_chunk(0.1), CHUNK_SIZE, None, None)
+        client.ptt_on()
+        client.audio_input_callback(self.make_chunk(0.2), CHUNK_SIZE, None, None)
+        self.assertEqual(self.udp_socket.sendto.call_count, client.PREROLL_CHUNKS + 1)
+        self.assertEqual(len(client.preroll_buffer), 0)
+
+        client.audio_input_callback(self.make_chunk(0.2), CHUNK_SIZE, None, None)
+        self.assertEqual(self.udp_socket.sendto.call_count, client.PREROLL_CHUNKS + 2)
+
+
+class TestDeviceFormat(unittest.TestCase):
+
+    def make_sd(self, max_channels, accepted_channels):
+        def check_settings(samplerate, channels, dtype):
+            if channels not in accepted_channels:
+                raise ValueError(f"Invalid number of channels: {channels}")
+        sd = mock.Mock()
+        sd.query_devices.return_value = {'default_samplerate': 44100.0,
+                                         'max_input_channels': max_channels, 'max_output_channels': max_channels}
+        sd.check_input_settings = sd.check_output_settings = check_settings
+        return sd
+
+    def test_prefers_codec_channel_count(self):
+        sd = self.make_sd(18, accepted_channels=range(1, 19))
+        self.assertEqual(client.query_device_format(sd, 'input'), (44100, CHANNELS))
+
+    def test_uses_smallest_accepted_channel_count(self):
+        """A multi-channel interface that rejects mono opens as stereo, not with all 18 channels."""
+        sd = self.make_sd(18, accepted_channels=(2, 4, 18))
+        self.assertEqual(client.query_device_format(sd, 'input'), (44100, 2))
+        self.assertEqual(client.query_device_format(sd, 'output'), (44100, 2))
+
+
+class TestStartupCleanup(unittest.TestCase):
+
+    def test_cancel_during_handshake_closes_prewarmed_streams(self):
+        """Ctrl+C/cancellation while connecting must close the streams opened in parallel,
+        and a missing keyboard module must not break startup."""
+        input_stream, output_stream = mock.Mock(), mock.Mock()
+
+        def slow_open_audio_streams():
+            time.sleep(0.1) # Still warming up when the task is cancelled
+            return input_stream, output_stream
+
+        async def never_connects(*args):
+            await asyncio.sleep(3600)
+
+        async def run():
+            task = asyncio.create_task(client.main_client('127.0.0.1', 12345))
+            await asyncio.sleep(0.02)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        with mock.patch.object(client, 'open_audio_streams', slow_open_audio_streams), \
+             mock.patch.object(client.asyncio, 'open_connection', never_connects), \
+             mock.patch.dict(sys.modules, {'keyboard': None}): # import keyboard raises ImportError
+            asyncio.run(run())
+
+        input_stream.close.assert_called_once()
+        output_stream.close.assert_called_once()
+        self.assertEqual(client.audio_input_callback.udp_socket.fileno(), -1) # Closed, not leaked
+        del client.audio_input_callback.udp_socket
+        del client.audio_input_callback.server_audio_addr
+
+    def test_slow_device_setup_is_closed_when_it_finishes(self):
+        """Exit doesn't wait indefinitely on a device that is still opening."""
+        input_stream, output_stream = mock.Mock(), mock.Mock()
+        release = threading.Event()
+
+        def stuck_open_audio_streams():
+            release.wait()
+            return input_stream, output_stream
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            audio_setup = executor.submit(stuck_open_audio_streams)
+            with mock.patch.object(client, 'AUDIO_SETUP_TIMEOUT', 0.01):
+                client.close_pending_audio_streams(audio_setup)
+            input_stream.close.assert_not_called()
+            release.set()
+        input_stream.close.assert_called_once()
+        output_stream.close.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
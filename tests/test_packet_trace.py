@@ -0,0 +1,157 @@
+import unittest
+import unittest.mock as mock
+import os
+import socket
+import tempfile
+import numpy as np
+
+import src.server as server
+from src.packet_trace import TraceWriter, read_trace, TRACE_MAGIC, RECORD_HEADER, FLAG_KNOWN_SENDER
+from src.replay import replay_trace, FRAME_DURATION
+from src.constants import CHUNK_SIZE
+
+def write_trace(path, records):
+    """
+    Writes (timestamp_seconds, addr, payload) or (timestamp_seconds, addr, payload, known_sender)
+    records with explicit timestamps. Senders are known unless stated otherwise.
+    """
+    with open(path, 'wb') as f:
+        f.write(TRACE_MAGIC)
+        for timestamp, addr, payload, *known_sender in records:
+            flags = FLAG_KNOWN_SENDER if known_sender in ([], [True]) else 0
+            f.write(RECORD_HEADER.pack(int(timestamp * 1e9), socket.inet_aton(addr[0]), addr[1], len(payload), flags))
+            f.write(payload)
+
+class TestPacketTrace(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'session.lctrace')
+        # Raw int16 PCM, which decode_audio accepts with or without Opus available
+        self.payload = (np.zeros(CHUNK_SIZE, dtype=np.int16)).tobytes()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_writer_reader_roundtrip(self):
+        """Records written by TraceWriter read back in order with sender and payload intact."""
+        writer = TraceWriter(self.path)
+        writer.write(('192.168.1.10', 40000), b'first', known_sender=True)
+        writer.write(('192.168.1.11', 40001), b'second packet', known_sender=False)
+        writer.close()
+
+        records = list(read_trace(self.path))
+        self.assertEqual([record[1:] for record in records],
+                         [(('192.168.1.10', 40000), b'first', True), (('192.168.1.11', 40001), b'second packet', False)])
+        self.assertLessEqual(records[0][0], records[1][0])
+
+    def test_read_rejects_bad_or_truncated_files(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not a trace')
+        with self.assertRaises(ValueError):
+            list(read_trace(self.path))
+
+        write_trace(self.path, [(0.0, ('10.0.0.1', 5000), b'abcdef')])
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - 2)
+        with self.assertRaises(ValueError):
+            list(read_trace(self.path))
+
+    def test_server_protocol_captures_datagrams(self):
+        """ServerAudioProtocol records every received datagram when given a TraceWriter."""
+        writer = TraceWriter(self.path)
+        protocol = server.ServerAudioProtocol(None, writer)
+        protocol.connection_made(mock.Mock())
+        with mock.patch.dict(server.clients_udp_audio, {('10.0.0.1', 1): ('10.0.0.1', 5000)}, clear=True):
+            protocol.datagram_received(b'known', ('10.0.0.1', 5000))
+            protocol.datagram_received(b'unknown', ('10.0.0.2', 5000))
+        writer.close()
+
+        self.assertEqual([(data, known) for _, _, data, known in read_trace(self.path)],
+                         [(b'known', True), (b'unknown', False)])
+
+    def test_replay_reports_loss_and_talk_over(self):
+        alice, bob = ('10.0.0.1', 5000), ('10.0.0.2', 5000)
+        records = [(i * FRAME_DURATION, alice, self.payload) for i in range(10) if i != 4] # One lost packet
+        records.append((2 * FRAME_DURATION + 0.001, bob, self.payload)) # Bob talks over Alice once
+        records.sort(key=lambda record: record[0])
+        write_trace(self.path, records)
+
+        saved_clients = dict(server.clients_udp_audio)
+        report = replay_trace(self.path)
+
+        self.assertEqual(server.clients_udp_audio, saved_clients, "Replay must restore the server's client table")
+        self.assertEqual(report['packets'], 10)
+        self.assertEqual(report['senders'], 2)
+        self.assertEqual(report['relayed_packets'], 10)
+        self.assertEqual(report['decode_errors'], 0)
+        self.assertEqual(report['concealment_events'], 1)
+        self.assertEqual(report['concealed_frames'], 1)
+        self.assertGreaterEqual(report['talk_over_packets'], 1)
+        self.assertEqual(report['stages']['relay']['count'], 10)
+        self.assertEqual(report['stages']['decode']['count'], 10)
+        self.assertNotIn('lateness', report['stages'])
+
+    def jittered_times(self, num_frames, lost=(), seed=1):
+        """Arrival times for one sender with up to +-9 ms random jitter plus a 31 ms/9 ms gap pair."""
+        rng = np.random.default_rng(seed)
+        times = [0.01 + i * FRAME_DURATION + rng.uniform(-0.009, 0.009) for i in range(num_frames)]
+        times[10] = times[9] + 0.031 # One late packet...
+        times[11] = times[10] + 0.009 # ...followed by an early one
+        return sorted(t for i, t in enumerate(times) if i not in lost)
+
+    def test_replay_jitter_without_loss_reports_no_concealment(self):
+        alice = ('10.0.0.1', 5000)
+        times = self.jittered_times(200)
+        # A pause (PTT released) starts a new talk spurt rather than counting as loss
+        times += [times[-1] + 1.0 + i * FRAME_DURATION for i in range(50)]
+        write_trace(self.path, [(t, alice, self.payload) for t in times])
+        report = replay_trace(self.path)
+        self.assertEqual(report['concealment_events'], 0)
+        self.assertEqual(report['concealed_frames'], 0)
+
+    def test_replay_drops_packets_the_relay_dropped(self):
+        """Packets from senders the live relay didn't know are not relayed or decoded in the replay."""
+        alice, stranger = ('10.0.0.1', 5000), ('10.0.0.9', 5000)
+        records = [(0.01 + i * FRAME_DURATION, alice, self.payload) for i in range(10)]
+        records += [(0.015 + i * FRAME_DURATION, stranger, self.payload, False) for i in range(10)]
+        records.append((0.01 + 10 * FRAME_DURATION, alice, self.payload, False)) # After Alice disconnected
+        write_trace(self.path, sorted(records, key=lambda record: record[0]))
+
+        report = replay_trace(self.path)
+        self.assertEqual(report['senders'], 1)
+        self.assertEqual(report['unknown_packets'], 11)
+        self.assertEqual(report['relayed_packets'], 10)
+        self.assertEqual(report['stages']['decode']['count'], 10)
+        self.assertEqual(report['talk_over_packets'], 0)
+
+    def test_replay_delay_spikes_are_not_loss(self):
+        """Packets held back and then delivered bunched together were late, not lost."""
+        alice = ('10.0.0.1', 5000)
+        times = [0.01 + i * FRAME_DURATION for i in range(40)]
+        for i, k in enumerate((5, 6, 7)): # Held 45 ms, then delivered back-to-back
+            times[k] = 0.01 + 5 * FRAME_DURATION + 0.045 + i * 0.0001
+        times[20] += 0.030 # Two packets late by 30 and 25 ms
+        times[21] += 0.025
+        write_trace(self.path, [(t, alice, self.payload) for t in sorted(times)])
+        report = replay_trace(self.path)
+        self.assertEqual(report['concealment_events'], 0)
+        self.assertEqual(report['concealed_frames'], 0)
+
+    def test_replay_counts_loss_under_jitter(self):
+        alice = ('10.0.0.1', 5000)
+        times = self.jittered_times(200, lost=(50, 120, 121, 122)) # A single loss and a burst of three
+        write_trace(self.path, [(t, alice, self.payload) for t in times])
+        report = replay_trace(self.path)
+        self.assertEqual(report['concealed_frames'], 4)
+        self.assertEqual(report['concealment_events'], 2)
+
+    def test_time_accurate_replay_measures_lateness(self):
+        write_trace(self.path, [(i * FRAME_DURATION, ('10.0.0.1', 5000), self.payload) for i in range(5)])
+        report = replay_trace(self.path, speed=4.0)
+        self.assertEqual(report['stages']['lateness']['count'], 5)
+        self.assertGreaterEqual(report['replay_wall_s'], 4 * FRAME_DURATION / 4.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import unittest
+import unittest.mock as mock
+import io
+import os
+import pstats
+import tempfile
+import contextlib
+import numpy as np
+from time import time_ns
+
+import src.profiling as profiling
+import src.server as server
+import src.client as client
+from src.constants import CHUNK_SIZE, CHANNELS
+
+class TestLatencyHistogram(unittest.TestCase):
+
+    def test_percentiles_and_mean(self):
+        histogram = profiling.LatencyHistogram()
+        for _ in range(90):
+            histogram.record(100_000) # 0.1 ms
+        for _ in range(10):
+            histogram.record(20_000_000) # 20 ms
+        self.assertEqual(histogram.count, 100)
+        self.assertAlmostEqual(histogram.mean_ms(), 0.1 * 0.9 + 20 * 0.1)
+        # Power-of-two buckets: the reported value is the bucket's upper bound
+        self.assertLessEqual(histogram.percentile_ms(50), 0.128)
+        self.assertGreaterEqual(histogram.percentile_ms(50), 0.1)
+        self.assertEqual(histogram.percentile_ms(99), 20.0) # Capped at the max seen
+
+    def test_empty_and_negative(self):
+        histogram = profiling.LatencyHistogram()
+        self.assertEqual(histogram.percentile_ms(95), 0.0)
+        histogram.record(-5) # Clock skew between hosts can make network samples negative
+        self.assertEqual(histogram.max_ns, 0)
+
+
+class TestPacketTimestamps(unittest.TestCase):
+
+    def test_stamp_roundtrip(self):
+        stamped = profiling.stamp_packet(b'opus-payload', 123456789)
+        self.assertEqual(profiling.unstamp_packet(stamped), (b'opus-payload', 123456789))
+
+    def test_unstamped_packets_pass_through(self):
+        self.assertEqual(profiling.unstamp_packet(b'opus-payload'), (b'opus-payload', None))
+        self.assertEqual(profiling.unstamp_packet(b''), (b'', None))
+
+
+class TestProfilingHooks(unittest.TestCase):
+
+    def setUp(self):
+        profiling.histograms.clear()
+        profiling.enabled = True
+
+    def tearDown(self):
+        profiling.enabled = False
+        profiling.adc_time_unavailable = False
+        profiling.histograms.clear()
+
+    def test_client_send_stamps_packets(self):
+        udp_socket = mock.Mock()
+        with mock.patch.object(client.audio_input_callback, 'udp_socket', udp_socket, create=True), \
+             mock.patch.object(client.audio_input_callback, 'server_audio_addr', ('127.0.0.1', 12346), create=True), \
+             mock.patch.object(client, 'encode_audio', return_value=b'payload'):
+            client.send_audio_chunk(None, capture_time_ns=42)
+        sent = udp_socket.sendto.call_args[0][0]
+        self.assertEqual(profiling.unstamp_packet(sent), (b'payload', 42))
+        self.assertEqual(profiling.histograms['encode'].count, 1)
+        self.assertEqual(profiling.histograms['send'].count, 1)
+
+    def test_client_send_unstamped_when_disabled(self):
+        profiling.enabled = False
+        udp_socket = mock.Mock()
+        with mock.patch.object(client.audio_input_callback, 'udp_socket', udp_socket, create=True), \
+             mock.patch.object(client.audio_input_callback, 'server_audio_addr', ('127.0.0.1', 12346), create=True), \
+             mock.patch.object(client, 'encode_audio', return_value=b'payload'):
+            client.send_audio_chunk(None, capture_time_ns=42)
+        udp_socket.sendto.assert_called_once_with(b'payload', ('127.0.0.1', 12346))
+        self.assertEqual(profiling.histograms, {})
+
+    def test_server_relay_records_stages(self):
+        protocol = server.ServerAudioProtocol(None)
+        transport = mock.Mock()
+        protocol.connection_made(transport)
+        clients = {('10.0.0.1', 1): ('10.0.0.1', 5000), ('10.0.0.2', 1): ('10.0.0.2', 5000)}
+        with mock.patch.dict(server.clients_udp_audio, clients, clear=True):
+            stamped = profiling.stamp_packet(b'payload', time_ns())
+            protocol.datagram_received(stamped, ('10.0.0.1', 5000))
+        transport.sendto.assert_called_once_with(stamped, ('10.0.0.2', 5000)) # Relayed unchanged
+        self.assertEqual(profiling.histograms['relay'].count, 1)
+        self.assertEqual(profiling.histograms['network_in'].count, 1)
+
+    def test_start_stop_writes_stats_and_report(self):
+        profiling.enabled = False
+        with tempfile.TemporaryDirectory() as tmpdir:
+            stats_path = os.path.join(tmpdir, 'test.prof')
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                profiling.start()
+                profiling.record('decode', 250_000)
+                profiling.record('capture', 5_000_000)
+                profiling.stop(stats_path, {'output_device': 10.0})
+            self.assertFalse(profiling.enabled)
+            self.assertTrue(os.path.exists(stats_path))
+            pstats.Stats(stats_path) # Loadable by the standard tools
+        report = output.getvalue()
+        self.assertIn('decode', report)
+        self.assertIn('output_device', report)
+        # Without network samples the sum would be meaningless
+        self.assertIn('Estimated mouth-to-ear: unavailable', report)
+
+    def test_unstamped_adc_time_falls_back_to_callback_entry(self):
+        """Host APIs reporting inputBufferAdcTime == 0 still produce timestamped packets."""
+        udp_socket = mock.Mock()
+        stream_time = mock.Mock(inputBufferAdcTime=0.0, currentTime=12.5)
+        indata = np.zeros((CHUNK_SIZE, CHANNELS), dtype=np.float32)
+        before_ns = time_ns()
+        with mock.patch.object(client.audio_input_callback, 'udp_socket', udp_socket, create=True), \
+             mock.patch.object(client.audio_input_callback, 'server_audio_addr', ('127.0.0.1', 12346), create=True), \
+             mock.patch.object(client, 'encode_audio', return_value=b'payload'), \
+             mock.patch.object(client, 'is_ptt_active', True):
+            client.preroll_buffer.clear()
+            client.audio_input_callback(indata, CHUNK_SIZE, stream_time, None)
+        payload, capture_time_ns = profiling.unstamp_packet(udp_socket.sendto.call_args[0][0])
+        self.assertEqual(payload, b'payload')
+        self.assertGreaterEqual(capture_time_ns, before_ns)
+        self.assertNotIn('capture', profiling.histograms)
+        self.assertTrue(profiling.adc_time_unavailable)
+
+        profiling.record('network', 5_000_000)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            profiling.print_latency_report()
+        self.assertIn('Estimated mouth-to-ear (mean): 5.00 ms', output.getvalue())
+        self.assertIn('no ADC timestamps', output.getvalue())
+
+    def test_mouth_to_ear_does_not_double_count_sender_stages(self):
+        """network is measured from the ADC stamp, so capture/encode/send are already inside it."""
+        profiling.record('capture', 20_000_000)
+        profiling.record('encode', 1_000_000)
+        profiling.record('send', 50_000)
+        profiling.record('network', 30_000_000) # 20 ms block + 1 ms encode + ~9 ms wire/relay/poll
+        profiling.record('decode', 500_000)
+        profiling.record('playout_write', 5_000_000)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            profiling.print_latency_report({'output_device': 10.0})
+        self.assertIn('Estimated mouth-to-ear (mean): 45.50 ms', output.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+import subprocess
+import sys
+import os
+import importlib.util
+import sysconfig
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Modules that must only be imported once a session is actually being set up
+LAZY_MODULES = ('sounddevice', 'keyboard', 'opuslib')
+
+# Third-party modules the client imports eagerly. NumPy is deliberate: every session needs it
+# before the first frame (float32 device buffers, resampler design, codec fallback), and the
+# handshake it could overlap with takes a few ms on a LAN. Its cost is reported, not budgeted.
+EAGER_THIRD_PARTY = ('numpy',)
+# Reported next to the client's own cost rather than counted against its budget
+BASELINE_MODULES = EAGER_THIRD_PARTY + ('asyncio',)
+
+# Budget for importing the client on top of BASELINE_MODULES (microseconds): the src modules
+# themselves take ~10 ms. Pulling in sounddevice/cffi, opuslib or another heavy module busts it.
+CLIENT_IMPORT_BUDGET_US = 30000
+IMPORTTIME_RUNS = 3 # Best of several fresh interpreters, to keep scheduler noise out
+
+def run_importtime(module_name=None):
+    """
+    Imports module_name in a fresh interpreter with `-X importtime` and returns
+    a dict mapping each imported module to its cumulative import time in microseconds.
+    With no module_name, returns what the interpreter imports at startup.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module_name}' if module_name else 'pass'],
+        cwd=PROJECT_ROOT, capture_output=True, text=True, check=True
+    )
+    timings = {}
+    for line in result.stderr.splitlines():
+        # Format: "import time: self [us] | cumulative | imported package"
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue # Header line
+        timings[fields[2].strip()] = int(fields[1])
+    return timings
+
+def is_installed_package(name):
+    """True if the top-level module name resolves to a package installed in site-packages."""
+    spec = importlib.util.find_spec(name)
+    locations = spec.submodule_search_locations or [spec.origin] if spec else []
+    site_dirs = {sysconfig.get_path('purelib'), sysconfig.get_path('platlib')}
+    return any(os.path.dirname(location) in site_dirs for location in locations if location)
+
+class TestStartupTime(unittest.TestCase):
+
+    def test_audio_utils_import_is_lazy(self):
+        """Importing audio_utils must not load PortAudio or the Opus library."""
+        timings = run_importtime('src.audio_utils')
+        self.assertIn('src.audio_utils', timings)
+        for module_name in LAZY_MODULES:
+            self.assertNotIn(module_name, timings, f"{module_name} should not be imported eagerly")
+
+    def test_client_imports_no_other_third_party_modules(self):
+        """NumPy is the only third-party package importing the client may load."""
+        startup = run_importtime()
+        top_level = {name.split('.')[0] for name in run_importtime('src.client') if name not in startup}
+        third_party = {name for name in top_level if is_installed_package(name)}
+        self.assertEqual(third_party, set(EAGER_THIRD_PARTY))
+
+    def test_client_import_is_lazy_and_fast(self):
+        """Importing the client must not load optional subsystems and should stay within budget."""
+        runs = [run_importtime('src.client') for _ in range(IMPORTTIME_RUNS)]
+        for timings in runs:
+            self.assertIn('src.client', timings)
+            for module_name in LAZY_MODULES:
+                self.assertNotIn(module_name, timings, f"{module_name} should not be imported eagerly")
+
+        def own_cost(timings):
+            return timings['src.client'] - sum(timings.get(name, 0) for name in BASELINE_MODULES)
+
+        best = min(runs, key=own_cost)
+        baseline = ", ".join(f"{name} {best.get(name, 0) / 1000:.1f} ms" for name in BASELINE_MODULES)
+        summary = (f"src.client import: {best['src.client'] / 1000:.1f} ms total = "
+                   f"{own_cost(best) / 1000:.1f} ms own + {baseline}")
+        print(summary)
+        self.assertLess(own_cost(best), CLIENT_IMPORT_BUDGET_US, summary)
+
+
+if __name__ == '__main__':
+    unittest.main()